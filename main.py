@@ -1,12 +1,20 @@
+import bisect
+import io
 import json
 import random
+import select
+import signal
 import time
 import sys
 import tty
 import termios
 import os
+import pickle
+import re
 from datetime import timedelta, datetime
-from collections import defaultdict
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
 
 # ANSI color codes - using standard codes for compatibility
 class Colors:
@@ -26,140 +34,491 @@ class Colors:
     CURSOR_HIGHLIGHT = '\033[0m\033[43m\033[30m'  # Yellow bg + black text
     ERROR_HIGHLIGHT = '\033[0m\033[41m\033[97m'  # Red bg + bright white text
 
-def clear_screen():
-    print('\033[2J\033[H\033[0m\033[97m', end='')  # Clear screen, reset, set bright white text
-
-def get_terminal_height():
-    """Get the terminal height in lines."""
-    return os.get_terminal_size().lines
+# The same codes pre-encoded, for frames that are built as bytes
+class BColors:
+    WHITE = Colors.WHITE.encode()
+    YELLOW = Colors.YELLOW.encode()
+    DIM = Colors.DIM.encode()
+    ORANGE = Colors.ORANGE.encode()
+
+# Cell states used to key the RENDER table
+CORRECT = 'correct'
+WRONG = 'wrong'
+CURSOR = 'cursor'
+DIM = 'dim'
+
+def build_render_entry(char, state):
+    """Build the colored display string of a single character cell.
+
+    For the WRONG state char is the typed character, otherwise the target one.
+    """
+    if state == WRONG:
+        # Show the incorrect character with red highlight, always one column wide
+        display_wrong = '↵' if char == '\n' else ('·' if char in (' ', '\t') else char)
+        return f"{Colors.ERROR_HIGHLIGHT}{display_wrong}"
+
+    # Convert tabs to 8 spaces for display, newlines occupy one blank cell
+    display_char = '        ' if char == '\t' else (' ' if char == '\n' else char)
+    if state == CORRECT:
+        return f"{Colors.WHITE}{display_char}"  # Correct chars are white
+    if state == CURSOR:
+        # Highlight current character cell with background (orange background + black text),
+        # at the end of a line show the cursor on the Enter key
+        if char == '\n':
+            display_char = '↵'
+        return f"{Colors.CURSOR_HIGHLIGHT}{display_char}"
+    return f"{Colors.DIM}{display_char}"
+
+# Precomputed, pre-encoded cells for printable ASCII, other characters are added on first use
+RENDER = {
+    (char, state): build_render_entry(char, state).encode()
+    for char in [chr(code) for code in range(32, 127)] + ['\t', '\n']
+    for state in (CORRECT, WRONG, CURSOR, DIM)
+}
+
+# Screen rows taken by display_header, the target text starts right below
+HEADER_ROWS = 6
+# Lines kept visible between the cursor and the top or bottom edge before scrolling
+SCROLL_OFF = 2
+
+# Pre-encoded sequences used while building frames
+CLEAR_FRAME = f'\033[0m\033[{HEADER_ROWS + 1};1H\033[J'.encode()  # Reset, move below the header and clear the rest
+LINE_END = BColors.WHITE + b'\r\n'  # Raw mode does not translate \n
+TAB_PAD = b'       '
+
+# Whitespace and commas between the elements of a JSON array
+ELEMENT_GAP = re.compile(r'[\s,]*')
+
+# Pre-encoded static parts of the header and the results screen
+CLEAR_SCREEN = b'\033[2J\033[H' + BColors.WHITE  # Clear screen, reset, set bright white text
+# The header is also redrawn in raw mode, so its lines end in \r\n
+RULE = BColors.ORANGE + b'=' * 80 + b'\r\n'
+HEADER_HINT = b'Type the code below. Press Ctrl+C to quit.'
+RESULTS_TITLE = RULE + BColors.ORANGE + b'RESULTS\r\n' + RULE
 
-def load_random_problem(filename='problems.json'):
-    """Load a random problem from the JSON file."""
-    with open(filename, 'r') as f:
-        data = json.load(f)
-    # Filter out empty problem lists
-    data = [p for p in data if p and len(p) > 0]
-    if not data:
+def clear_screen():
+    write_frame([CLEAR_SCREEN])
+
+@lru_cache(maxsize=None)
+def get_terminal_size():
+    """Get the terminal size (columns, lines), cached until the terminal is resized."""
+    return os.get_terminal_size()
+
+def handle_resize(signum, frame):
+    """SIGWINCH handler, makes the next get_terminal_size call ask the terminal again."""
+    get_terminal_size.cache_clear()
+
+def build_problem_index(filename):
+    """Find the (byte offset, length) of every non-empty problem list in the JSON file."""
+    with open(filename, 'rb') as f:
+        text = f.read().decode('utf-8')
+    decoder = json.JSONDecoder()
+    index = []
+    pos = text.index('[') + 1
+    byte_pos = len(text[:pos].encode())
+    while True:
+        # Skip the whitespace and commas between elements of the top-level array
+        start = ELEMENT_GAP.match(text, pos).end()
+        byte_pos += len(text[pos:start].encode())
+        if text[start] == ']':
+            return index
+        problem_list, pos = decoder.raw_decode(text, start)
+        length = len(text[start:pos].encode())
+        # Skip empty problem lists
+        if problem_list:
+            index.append((byte_pos, length))
+        byte_pos += length
+
+def file_stamp(filename):
+    """Return the (size, mtime) of a file, which the cached index must match exactly."""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+def rebuild_problem_index(filename):
+    """Index the JSON file and cache the index in a pickle next to it."""
+    stamp = file_stamp(filename)
+    index = build_problem_index(filename)
+    try:
+        with open(filename + '.idx', 'wb') as f:
+            pickle.dump((stamp, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # The cache only speeds up the next start
+    return index
+
+@lru_cache(maxsize=None)
+def load_problem_index(filename):
+    """Load the problem index of the JSON file, once per process.
+
+    The index is also cached in a pickle next to the JSON file together with
+    the size and mtime of the file it was built from. It is rebuilt whenever
+    those differ, an older file restored with its mtime is caught too.
+    """
+    try:
+        with open(filename + '.idx', 'rb') as f:
+            stamp, index = pickle.load(f)
+        if stamp == file_stamp(filename):
+            return index
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError):
+        pass  # Missing or broken cache, index the JSON file instead
+    return rebuild_problem_index(filename)
+
+def read_problem(filename, index):
+    """Parse a random problem of the index, reading only its slice of the JSON file."""
+    if not index:
         raise ValueError("No valid problems found in JSON file")
-    problem_list = random.choice(data)
-    problem = problem_list[0]
+    offset, length = random.choice(index)
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        problem = json.loads(f.read(length))[0]
     return problem['id'], problem['code']
 
+def load_random_problem(filename='problems.json'):
+    """Load a random problem from the JSON file, parsing only that problem."""
+    index = load_problem_index(filename)
+    try:
+        return read_problem(filename, index)
+    except (ValueError, LookupError, TypeError):
+        if not index:
+            raise
+        # The slice was not a problem, so the index is out of date after all, index the file again once
+        load_problem_index.cache_clear()
+        return read_problem(filename, rebuild_problem_index(filename))
+
+def leading_whitespace(line):
+    """Return the leading whitespace (tabs and spaces) of a line."""
+    return line[:len(line) - len(line.lstrip(' \t'))]
+
+def encode_cells(text):
+    """Return the code of every character of text, indexable like bytes.
+
+    Typed characters are kept as one byte each while they fit latin-1, so bytes
+    work whenever the text fits latin-1. Otherwise fall back to a list of code
+    points, which keeps one entry per character.
+    """
+    try:
+        return text.encode('latin-1')
+    except UnicodeEncodeError:
+        return [ord(c) for c in text]
+
+def build_enter_actions(target_lines, line_starts):
+    """Map the position of every newline in the target to the text Enter types there.
+
+    If next line has less indentation, Enter types just the newline, otherwise
+    the newline followed by the current line's indentation.
+    """
+    indents = [leading_whitespace(line) for line in target_lines]
+    enter_actions = {}
+    for line_idx in range(len(target_lines) - 1):
+        current_indent = indents[line_idx]
+        newline_pos = line_starts[line_idx + 1] - 1
+        if len(indents[line_idx + 1]) < len(current_indent):
+            enter_actions[newline_pos] = '\n'
+        else:
+            enter_actions[newline_pos] = '\n' + current_indent
+    return enter_actions
+
+def mismatched_targets(inserted, target_text, pos):
+    """Return the target characters that text inserted at pos got wrong.
+
+    Characters inserted past the end of target_text are not compared.
+    """
+    target_slice = target_text[pos:pos + len(inserted)]
+    return [target_char for typed_char, target_char in zip(inserted, target_slice) if typed_char != target_char]
+
+# A byte read while looking for a UTF-8 continuation that turned out to start the next key
+PENDING_INPUT = bytearray()
+
 def get_char():
-    """Get a single character from stdin without waiting for Enter."""
+    """Get a single character from stdin, which must already be in raw mode.
+
+    Multi-byte UTF-8 sequences are read whole and returned as one character.
+    Invalid bytes come back as U+FFFD without swallowing the keys after them.
+    """
     fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    try:
-        tty.setraw(fd)
-        char = sys.stdin.read(1)
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-    return char
+    lead = PENDING_INPUT.pop(0) if PENDING_INPUT else os.read(fd, 1)[0]
+    data = bytearray([lead])
+    if 0xC0 <= lead < 0xF8:
+        # The lead byte tells how many continuation bytes follow
+        length = 2 if lead < 0xE0 else (3 if lead < 0xF0 else 4)
+        while len(data) < length:
+            byte = os.read(fd, 1)[0]
+            if byte & 0xC0 != 0x80:
+                PENDING_INPUT.append(byte)  # Not a continuation, handle it as the next key
+                break
+            data.append(byte)
+    return data.decode('utf-8', 'replace')[0]
+
+def build_header(problem_id, columns):
+    """Build the header with problem information.
+
+    Every line is cut to the terminal width so that the header always takes
+    exactly HEADER_ROWS rows.
+    """
+    rule = BColors.ORANGE + b'=' * min(80, columns) + b'\r\n'
+    return (rule + BColors.ORANGE + b'TYPING SPEED TEST'[:columns] + b'\r\n' + rule +
+            BColors.YELLOW + f"Problem: {problem_id}"[:columns].encode() + b'\r\n' +
+            BColors.DIM + HEADER_HINT[:columns] + b'\r\n\r\n')
 
 def display_header(problem_id):
     """Display the header with problem information."""
-    print(f"{Colors.ORANGE}{'='*80}")
-    print(f"{Colors.ORANGE}TYPING SPEED TEST")
-    print(f"{Colors.ORANGE}{'='*80}")
-    print(f"{Colors.YELLOW}Problem: {problem_id}")
-    print(f"{Colors.DIM}Type the code below. Press Ctrl+C to quit.\n")
-
-def calculate_scroll_window(target_text, current_pos, terminal_height):
-    """Calculate which lines to display based on cursor position for smooth scrolling."""
-    lines = target_text.split('\n')
-
-    # Reserve lines for header (5 lines)
-    header_lines = 5
-    available_lines = terminal_height - header_lines
-
-    # Find which line the cursor is on
-    char_count = 0
-    cursor_line = 0
-    for line_idx, line in enumerate(lines):
-        if char_count + len(line) >= current_pos:
-            cursor_line = line_idx
-            break
-        char_count += len(line) + 1  # +1 for newline
+    write_frame([build_header(problem_id, get_terminal_size().columns)])
+
+def build_line_widths(target_lines):
+    """Return the number of columns every target line takes, its newline cell included."""
+    widths = [len(line) + 7 * line.count('\t') + 1 for line in target_lines]  # Tabs are displayed as 8 spaces
+    widths[-1] -= 1  # The last line has no newline
+    return widths
+
+def count_line_rows(line_widths, columns):
+    """Return the number of screen rows every target line wraps to at the given terminal width."""
+    return [max(1, -(-width // columns)) for width in line_widths]
+
+def fill_window(line_rows, start_line, available_rows):
+    """Return the end of the lines from start_line that fit in available_rows, at least one line."""
+    end_line = start_line + 1
+    rows = line_rows[start_line]
+    while end_line < len(line_rows) and rows + line_rows[end_line] <= available_rows:
+        rows += line_rows[end_line]
+        end_line += 1
+    return end_line
+
+def calculate_scroll_window(line_rows, line_starts, current_pos, terminal_height, start_line=None):
+    """Calculate which lines to display based on cursor position for smooth scrolling.
+
+    line_rows holds the screen rows every line wraps to. The window starting
+    at start_line is kept while the cursor stays more than SCROLL_OFF lines
+    away from its edges, so that most line changes can be drawn in place.
+    Otherwise the window is moved to center the cursor.
+    """
+    # Reserve lines for header
+    available_rows = terminal_height - HEADER_ROWS
+
+    # Find which line the cursor is on, a newline belongs to the line it ends
+    cursor_line = bisect.bisect_right(line_starts, current_pos) - 1
+
+    if start_line is not None:
+        end_line = fill_window(line_rows, start_line, available_rows)
+        margin = min(SCROLL_OFF, (end_line - start_line - 1) // 2)
+        # Near the start or end of the text there is nothing more to scroll to
+        if (start_line == 0 or cursor_line >= start_line + margin) and \
+                (end_line == len(line_rows) or cursor_line < end_line - margin):
+            return start_line, end_line
 
     # Calculate the window with cursor roughly in the middle
-    center_offset = available_lines // 2
-    start_line = max(0, cursor_line - center_offset)
-    end_line = min(len(lines), start_line + available_lines)
+    start_line = cursor_line
+    rows_above = 0
+    while start_line > 0 and rows_above + line_rows[start_line - 1] <= available_rows // 2:
+        start_line -= 1
+        rows_above += line_rows[start_line]
+    end_line = fill_window(line_rows, start_line, available_rows)
+    if end_line <= cursor_line:
+        # Long wrapped lines around the cursor, start the window at it
+        start_line = cursor_line
+        end_line = fill_window(line_rows, start_line, available_rows)
 
     # Adjust if we're at the end
-    if end_line == len(lines):
-        start_line = max(0, end_line - available_lines)
+    if end_line == len(line_rows):
+        rows = sum(line_rows[start_line:end_line])
+        while start_line > 0 and rows + line_rows[start_line - 1] <= available_rows:
+            start_line -= 1
+            rows += line_rows[start_line]
 
     return start_line, end_line
 
-def display_text_with_cursor(target_text, typed_text, current_pos):
-    """Display the target text with color-coded typed characters and cursor."""
-    print('\033[H\033[J', end='')  # Clear screen and move to top
-
-    lines = target_text.split('\n')
-    terminal_height = get_terminal_height()
-    start_line, end_line = calculate_scroll_window(target_text, current_pos, terminal_height)
-
-    char_count = 0
-    # Calculate char_count offset for start_line
-    for i in range(start_line):
-        char_count += len(lines[i]) + 1  # +1 for newline
-
+def build_char_positions(target_text):
+    """Map every character index of target_text to its (line, column) on screen.
+
+    The column counts from the start of the target line, wrapping is left to
+    the caller.
+    """
+    positions = []
+    line = 0
+    col = 0
+    for char in target_text:
+        positions.append((line, col))
+        if char == '\n':
+            line += 1
+            col = 0
+        else:
+            col += 8 if char == '\t' else 1  # Tabs are displayed as 8 spaces
+    return positions
+
+def render_cell(char, typed_buf, current_pos, abs_pos):
+    """Render the target character char found at abs_pos in its current typing state.
+
+    Every cell keeps the width of its target character so that single cells can
+    be repainted in place without shifting the rest of the line.
+    """
+    if abs_pos < len(typed_buf):
+        typed_char = chr(typed_buf[abs_pos])
+        key = (char, CORRECT) if typed_char == char else (typed_char, WRONG)
+    elif abs_pos == current_pos:
+        key = (char, CURSOR)
+    else:
+        key = (char, DIM)
+
+    cell = RENDER.get(key)
+    if cell is None:
+        cell = RENDER[key] = build_render_entry(*key).encode()
+    if key[1] == WRONG and char == '\t':
+        cell += TAB_PAD  # Pad the wrong character to the width of the tab
+    return cell
+
+def write_frame(parts):
+    """Write a whole frame of pre-encoded chunks straight to the terminal.
+
+    This bypasses sys.stdout, so anything printed before must already be flushed.
+    """
+    frame = b''.join(parts)
+    while frame:
+        frame = frame[os.write(sys.stdout.fileno(), frame):]
+
+def build_display_text(target_text):
+    """Encode the target as it is displayed, tabs as 8 spaces and newlines as one blank cell.
+
+    Also return the byte offset at which every character starts, plus one past
+    the end, so that any run of characters is displayed with a single slice.
+    """
+    display_text = target_text.replace('\t', '        ').replace('\n', ' ').encode()
+    display_offsets = [0]
+    for char in target_text:
+        display_offsets.append(display_offsets[-1] + (8 if char == '\t' else len(char.encode())))
+    return display_text, display_offsets
+
+def render_typed_runs(target_text, target_bytes, display_text, display_offsets, typed_buf, start, end):
+    """Render the typed cells from start to end as runs of correct characters.
+
+    Each run of correct characters gets one color prefix instead of one per
+    cell. Only wrong characters are rendered cell by cell.
+    """
+    # Usually the whole stretch was typed correctly, a single C-level compare tells
+    if typed_buf[start:end] == target_bytes[start:end]:
+        mismatches = []
+    else:
+        mismatches = [pos for pos, typed, target in zip(range(start, end), typed_buf[start:end], target_bytes[start:end])
+                      if typed != target]
+
+    parts = []
+    run_start = start
+    for pos in mismatches + [end]:
+        if run_start < pos:
+            parts.append(BColors.WHITE + display_text[display_offsets[run_start]:display_offsets[pos]])
+        if pos < end:
+            parts.append(render_cell(target_text[pos], typed_buf, pos + 1, pos))
+        run_start = pos + 1
+    return parts
+
+def display_text_with_cursor(target_text, target_bytes, display_text, display_offsets, line_starts, char_positions,
+                             line_rows, columns, available_rows, typed_buf, current_pos, start_line, end_line):
+    """Display the target text with color-coded typed characters and cursor.
+
+    Long lines are left to wrap at the terminal edge. A single line taller
+    than the available rows is cut off at the bottom row.
+    """
+    parts = [CLEAR_FRAME]
+
+    rows_left = available_rows
     for line_idx in range(start_line, end_line):
-        line = lines[line_idx]
-        output = ""
-        for char_idx, char in enumerate(line):
-            abs_pos = char_count + char_idx
-
-            # Convert tabs to 8 spaces for display
-            display_char = '        ' if char == '\t' else char
-
-            if abs_pos < len(typed_text):
-                if typed_text[abs_pos] == char:
-                    output += f"{Colors.WHITE}{display_char}"  # Correct chars are white
-                else:
-                    # Show the incorrect character with red highlight
-                    wrong_char = typed_text[abs_pos]
-                    display_wrong = '        ' if wrong_char == '\t' else ('·' if wrong_char == ' ' else wrong_char)
-                    output += f"{Colors.ERROR_HIGHLIGHT}{display_wrong}"
-            elif abs_pos == current_pos:
-                # Highlight current character cell with background (orange background + black text)
-                if char == ' ':
-                    # For spaces, show highlighted block
-                    output += f"{Colors.CURSOR_HIGHLIGHT} "
-                else:
-                    output += f"{Colors.CURSOR_HIGHLIGHT}{display_char}"
-            else:
-                output += f"{Colors.DIM}{display_char}"
-
-        # Check if cursor is at end of line (one position after last char)
-        end_of_line_pos = char_count + len(line)
-        if end_of_line_pos == current_pos and line_idx < len(lines) - 1:
-            # Show cursor at end of line for Enter key (orange background + black text)
-            output += f"{Colors.CURSOR_HIGHLIGHT}↵"
-
-        print(output + Colors.WHITE)
-        char_count += len(line)
-
-
-        # Account for newline character
-        if line_idx < len(lines) - 1:
-            if char_count < len(typed_text):
-
-                pass
-            elif char_count == current_pos:
-                #print(f"\033[48;2;222;157;105m{Colors.BOLD}↵\033[0m")  # Highlight newline with background
-                pass
-            else:
-                pass
-
-            char_count += 1
-
-def calculate_metrics(target_text, typed_text, elapsed_time, all_typed_chars, wrong_typed_chars):
+        # No line break after the last row, it would scroll the header away
+        if line_idx > start_line:
+            parts.append(LINE_END)
+        # Cells of the line, including the newline cell on every line but the last
+        line_start = line_starts[line_idx]
+        line_end = min(line_starts[line_idx + 1], len(target_text))
+        if line_rows[line_idx] > rows_left:
+            line_end = bisect.bisect_left(char_positions, (line_idx, rows_left * columns), line_start, line_end)
+        rows_left -= line_rows[line_idx]
+        # Typed cells are rendered in runs, the untyped rest of the line is one dim slice
+        typed_end = max(line_start, min(current_pos, line_end))
+        parts.extend(render_typed_runs(target_text, target_bytes, display_text, display_offsets, typed_buf,
+                                       line_start, typed_end))
+        if line_start <= current_pos < line_end:
+            parts.append(render_cell(target_text[current_pos], typed_buf, current_pos, current_pos))
+            typed_end += 1
+        if typed_end < line_end:
+            parts.append(BColors.DIM + display_text[display_offsets[typed_end]:display_offsets[line_end]])
+
+    write_frame(parts)
+
+@lru_cache(maxsize=4096)
+def cursor_move(row, col):
+    """Return the encoded sequence moving the cursor to a 1-based screen row and column."""
+    return f"\033[{row};{col}H".encode()
+
+def update_cells(target_text, char_positions, typed_buf, current_pos, changed_positions, start_line, line_tops,
+                 columns, last_row):
+    """Repaint only the given character cells in place using cursor-move sequences.
+
+    line_tops holds the screen row of every line of the window from start_line,
+    cells are placed where the terminal wrapped them.
+    """
+    parts = []
+    for abs_pos in sorted(changed_positions):
+        if abs_pos >= len(target_text):
+            continue
+        line, col = char_positions[abs_pos]
+        if start_line <= line < start_line + len(line_tops):
+            row = line_tops[line - start_line] + col // columns
+            if row <= last_row:
+                parts.append(cursor_move(row, col % columns + 1))
+                parts.append(render_cell(target_text[abs_pos], typed_buf, current_pos, abs_pos))
+    write_frame(parts)
+
+@dataclass
+class RenderState:
+    """What is on screen since the last frame, so the next one repaints only what changed."""
+    start_line: int = 0  # Visible window of target lines
+    end_line: int = 0  # An empty window means nothing has been drawn yet
+    cursor_line: int = 0
+    terminal_size: tuple = (0, 0)
+    line_rows: list = field(default_factory=list)  # Screen rows of every target line at that width
+    line_tops: list = field(default_factory=list)  # Screen row of every line of the window
+    prev_pos: int = 0  # Cursor position at the last frame
+    min_pos: int = 0  # Lowest cursor position since the last frame
+
+def refresh_screen(state, problem_id, target_text, target_bytes, display_text, display_offsets, line_widths,
+                   line_starts, char_positions, typed_buf, current_pos):
+    """Bring the screen up to date with the typing state and record it in state."""
+    cursor_line = char_positions[current_pos][0]
+    terminal_size = get_terminal_size()
+    if terminal_size != state.terminal_size:
+        # The terminal may have re-wrapped, moved or cleared what was drawn,
+        # so after a resize the header comes back and the text is laid out again
+        if state.end_line:
+            write_frame([CLEAR_SCREEN, build_header(problem_id, terminal_size.columns)])
+        state.terminal_size = terminal_size
+        state.line_rows = count_line_rows(line_widths, terminal_size.columns)
+        state.end_line = 0
+    # The window only moves when the cursor changes line or everything is drawn again
+    if cursor_line != state.cursor_line or state.end_line == 0:
+        kept_start = state.start_line if state.end_line else None
+        start_line, end_line = calculate_scroll_window(state.line_rows, line_starts, current_pos, terminal_size.lines,
+                                                       kept_start)
+        state.cursor_line = cursor_line
+    else:
+        start_line, end_line = state.start_line, state.end_line
+
+    if (start_line, end_line) != (state.start_line, state.end_line):
+        display_text_with_cursor(target_text, target_bytes, display_text, display_offsets, line_starts, char_positions,
+                                 state.line_rows, terminal_size.columns, terminal_size.lines - HEADER_ROWS,
+                                 typed_buf, current_pos, start_line, end_line)
+        state.start_line, state.end_line = start_line, end_line
+        state.line_tops = [HEADER_ROWS + 1]
+        for rows in state.line_rows[start_line:end_line - 1]:
+            state.line_tops.append(state.line_tops[-1] + rows)
+    else:
+        # The cursor always sits at the end of the typed text, so only the
+        # cells between the lowest cursor position since the last frame and
+        # the old or new cursor position changed
+        changed_positions = range(state.min_pos, max(state.prev_pos, current_pos) + 1)
+        update_cells(target_text, char_positions, typed_buf, current_pos, changed_positions, start_line,
+                     state.line_tops, terminal_size.columns, terminal_size.lines)
+    state.prev_pos = state.min_pos = current_pos
+
+def calculate_metrics(target_text, typed_text, elapsed_time, all_typed_chars, wrong_typed_chars, correct_chars):
     """Calculate typing metrics."""
     total_chars = len(target_text)
     typed_chars = len(typed_text)
-    correct_chars = sum(1 for i, c in enumerate(typed_text) if i < len(target_text) and c == target_text[i])
 
     minutes = elapsed_time / 60
     # WPM: ((ALL TYPED CHARS / 5) - wrong typed chars) / Time in minutes
@@ -179,25 +538,24 @@ def calculate_metrics(target_text, typed_text, elapsed_time, all_typed_chars, wr
 
 def display_results(metrics, missed_chars):
     """Display final results."""
-    clear_screen()
-    print(f"{Colors.ORANGE}{'='*80}")
-    print(f"{Colors.ORANGE}RESULTS")
-    print(f"{Colors.ORANGE}{'='*80}")
-    print(f"{Colors.WHITE}Time Elapsed: {timedelta(seconds=int(metrics['time']))}")
-    print(f"{Colors.WHITE}Words Per Minute (WPM): {Colors.GREEN}{metrics['wpm']:.1f}")
-    print(f"{Colors.WHITE}Accuracy: {Colors.GREEN if metrics['accuracy'] >= 95 else Colors.YELLOW}{metrics['accuracy']:.1f}%")
-    print(f"{Colors.WHITE}Character Breakdown:")
-    print(f"{Colors.WHITE}  Target Characters: {metrics['total_chars']}")
-    print(f"{Colors.WHITE}  {Colors.GREEN}Correct: {metrics['correct_chars']}")
-    print(f"{Colors.WHITE}  {Colors.RED}Wrong: {metrics['wrong_typed_chars']}")
-    print(f"{Colors.WHITE}  Total Typed: {metrics['all_typed_chars']}")
+    lines = [
+        f"{Colors.WHITE}Time Elapsed: {timedelta(seconds=int(metrics['time']))}",
+        f"{Colors.WHITE}Words Per Minute (WPM): {Colors.GREEN}{metrics['wpm']:.1f}",
+        f"{Colors.WHITE}Accuracy: {Colors.GREEN if metrics['accuracy'] >= 95 else Colors.YELLOW}{metrics['accuracy']:.1f}%",
+        f"{Colors.WHITE}Character Breakdown:",
+        f"{Colors.WHITE}  Target Characters: {metrics['total_chars']}",
+        f"{Colors.WHITE}  {Colors.GREEN}Correct: {metrics['correct_chars']}",
+        f"{Colors.WHITE}  {Colors.RED}Wrong: {metrics['wrong_typed_chars']}",
+        f"{Colors.WHITE}  Total Typed: {metrics['all_typed_chars']}",
+    ]
 
     if missed_chars:
-        print(f"\n{Colors.WHITE}Most Missed Characters:")
-        sorted_missed = sorted(missed_chars.items(), key=lambda x: x[1], reverse=True)
-        for char, count in sorted_missed[:10]:  # Show top 10
+        lines.append(f"\n{Colors.WHITE}Most Missed Characters:")
+        for char, count in missed_chars.most_common(10):  # Show top 10
             display_char = repr(char) if char in ('\n', '\t', ' ') else char
-            print(f"{Colors.WHITE}  {Colors.RED}{display_char}: {count}")
+            lines.append(f"{Colors.WHITE}  {Colors.RED}{display_char}: {count}")
+
+    write_frame([CLEAR_SCREEN, RESULTS_TITLE, '\n'.join(lines).encode(), b'\n'])
 
 
 def save_to_data_file(metrics):
@@ -237,12 +595,14 @@ def plot_terminal(data_file='data.txt'):
         max_wpm = max(wpms) if wpms else 1
         max_accuracy = 100  # Accuracy is always 0-100
 
-        print(f"\n{Colors.ORANGE}{'='*80}")
-        print(f"{Colors.ORANGE}PROGRESS OVER TIME")
-        print(f"{Colors.ORANGE}{'='*80}\n")
+        # Collect the whole plot and write it to the terminal at once
+        buf = io.StringIO()
+        buf.write(f"\n{Colors.ORANGE}{'='*80}\n")
+        buf.write(f"{Colors.ORANGE}PROGRESS OVER TIME\n")
+        buf.write(f"{Colors.ORANGE}{'='*80}\n\n")
 
         # Plot header
-        print(f"{Colors.WHITE}       WPM                                 Accuracy (%)")
+        buf.write(f"{Colors.WHITE}       WPM                                 Accuracy (%)\n")
 
         # Plot both graphs side by side
         for row in range(plot_height, 0, -1):
@@ -250,31 +610,32 @@ def plot_terminal(data_file='data.txt'):
             acc_threshold = (row / plot_height) * max_accuracy
 
             # WPM side
-            line = f"{Colors.DIM}{wpm_threshold:5.1f} {Colors.WHITE}│"
+            buf.write(f"{Colors.DIM}{wpm_threshold:5.1f} {Colors.WHITE}│")
             for i, wpm in enumerate(wpms[-plot_width:]):
                 if wpm >= wpm_threshold:
-                    line += f"{Colors.GREEN}▇"
+                    buf.write(f"{Colors.GREEN}▇")
                 else:
-                    line += f"{Colors.DIM}·"
+                    buf.write(f"{Colors.DIM}·")
 
             # Spacing
-            line += f"{Colors.WHITE}  "
+            buf.write(f"{Colors.WHITE}  ")
 
             # Accuracy side
-            line += f"{Colors.DIM}{acc_threshold:5.1f} {Colors.WHITE}│"
+            buf.write(f"{Colors.DIM}{acc_threshold:5.1f} {Colors.WHITE}│")
             for i, acc in enumerate(accuracies[-plot_width:]):
                 if acc >= acc_threshold:
-                    line += f"{Colors.GREEN}▇"
+                    buf.write(f"{Colors.GREEN}▇")
                 else:
-                    line += f"{Colors.DIM}·"
+                    buf.write(f"{Colors.DIM}·")
 
-            print(line)
+            buf.write("\n")
 
         # Bottom axis
-        print(f"{Colors.DIM}      └{'─' * min(len(wpms), plot_width)}  {'      └'}{'─' * min(len(accuracies), plot_width)}")
+        buf.write(f"{Colors.DIM}      └{'─' * min(len(wpms), plot_width)}  {'      └'}{'─' * min(len(accuracies), plot_width)}\n")
 
-        print(f"\n{Colors.DIM}Showing last {min(len(wpms), plot_width)} runs")
-        print(f"{Colors.ORANGE}{'='*80}\n")
+        buf.write(f"\n{Colors.DIM}Showing last {min(len(wpms), plot_width)} runs\n")
+        buf.write(f"{Colors.ORANGE}{'='*80}\n\n")
+        write_frame([buf.getvalue().encode()])
 
     except FileNotFoundError:
         print(f"{Colors.YELLOW}No data file found yet. Complete a test to start tracking progress.")
@@ -288,104 +649,106 @@ def main():
         display_header(problem_id)
 
         # Initialize
-        typed_text = ""
+        typed_buf = bytearray()  # Code of every typed character, a list once one does not fit a byte
         start_time = None  # Will start on first key press
         current_pos = 0
         all_typed_chars = 0  # Track all characters typed including deleted ones
         wrong_typed_chars = 0  # Track characters that were typed incorrectly
-        missed_chars = defaultdict(int)  # Track which characters were missed
-
-        clear_screen()
-        display_header(problem_id)
-        # Main typing loop
-        while current_pos < len(target_text):
-            display_header(problem_id)
-            display_text_with_cursor(target_text, typed_text, current_pos)
-
-            char = get_char()
-
-            # Start timer on first keypress
-            if start_time is None:
-                start_time = time.time()
-
-            # Handle special keys
-            if ord(char) == 3:  # Ctrl+C
-                raise KeyboardInterrupt
-            elif ord(char) == 127:  # Backspace
-                if typed_text:
-                    typed_text = typed_text[:-1]
+        correct_chars = 0  # Typed characters currently matching the target
+        missed_chars = Counter()  # Track which characters were missed
+
+        target_lines = target_text.split('\n')
+        # Offset of the first character of every line, plus one past the end as a sentinel
+        line_starts = [0]
+        for line in target_lines:
+            line_starts.append(line_starts[-1] + len(line) + 1)
+        char_positions = build_char_positions(target_text)
+        line_widths = build_line_widths(target_lines)
+        display_text, display_offsets = build_display_text(target_text)
+        target_bytes = encode_cells(target_text)
+        enter_actions = build_enter_actions(target_lines, line_starts)
+        render_state = RenderState()
+        # Bind everything that is fixed for this problem once, frames then only pass the typing state
+        refresh = partial(refresh_screen, render_state, problem_id, target_text, target_bytes,
+                          display_text, display_offsets, line_widths, line_starts, char_positions)
+        dirty = True  # Whether the screen lags behind the typing state
+        signal.signal(signal.SIGWINCH, handle_resize)
+        # Switch the terminal to raw mode once for the whole test
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        tty.setraw(fd)
+        try:
+            # Main typing loop
+            while current_pos < len(target_text):
+                # Keys that have already arrived (fast typing, pastes) are all
+                # handled before the next frame is drawn
+                if dirty and not select.select([fd], [], [], 0)[0]:
+                    refresh(typed_buf, current_pos)
+                    dirty = False
+
+                char = get_char()
+
+                # Start timer on first keypress
+                if start_time is None:
+                    start_time = time.time()
+
+                # Handle special keys
+                char_byte = ord(char)
+                if char_byte == 3:  # Ctrl+C
+                    raise KeyboardInterrupt
+                elif char_byte == 127:  # Backspace
+                    if not typed_buf:
+                        continue  # Nothing to delete, the screen stays as it is
+                    last_pos = len(typed_buf) - 1
+                    if last_pos < len(target_text) and typed_buf[last_pos] == target_bytes[last_pos]:
+                        correct_chars -= 1
+                    del typed_buf[-1]
                     current_pos = max(0, current_pos - 1)
-            elif char == '\t':  # Tab key
-                typed_text += '  '  # Insert 2 spaces
-                all_typed_chars += 2
-                # Check if these characters are correct
-                for i in range(current_pos, min(current_pos + 2, len(target_text))):
-                    if i >= len(target_text) or typed_text[i] != target_text[i]:
-                        wrong_typed_chars += 1
-                        if i < len(target_text):
-                            missed_chars[target_text[i]] += 1
-                current_pos += 2
-            elif char == '\n' or char == '\r':  # Enter key - autoindent
-                # Find the start of the current line in target_text
-                target_line_start = target_text.rfind('\n', 0, current_pos) + 1
-                target_line = target_text[target_line_start:target_text.find('\n', target_line_start) if '\n' in target_text[target_line_start:] else len(target_text)]
-
-                # Count leading whitespace (tabs and spaces) in current line
-                current_indent = ''
-                for c in target_line:
-                    if c in ('\t', ' '):
-                        current_indent += c
-                    else:
-                        break
-
-                # Find next line's indentation
-                next_line_start = current_pos + 1
-                next_line_end = target_text.find('\n', next_line_start) if '\n' in target_text[next_line_start:] else len(target_text)
-                next_line = target_text[next_line_start:next_line_end]
-
-                next_indent = ''
-                for c in next_line:
-                    if c in ('\t', ' '):
-                        next_indent += c
-                    else:
-                        break
-
-                # If next line has less indentation, just skip to next char (newline only)
-                # Otherwise use current line's indentation
-                if len(next_indent) < len(current_indent):
-                    typed_text += '\n'
-                    all_typed_chars += 1
-                    if current_pos >= len(target_text) or typed_text[current_pos] != target_text[current_pos]:
-                        wrong_typed_chars += 1
-                        if current_pos < len(target_text):
-                            missed_chars[target_text[current_pos]] += 1
-                    current_pos += 1
-                else:
-                    indent_to_add = '\n' + current_indent
-                    typed_text += indent_to_add
+                elif char == '\t':  # Tab key
+                    typed_buf += b'  '  # Insert 2 spaces
+                    all_typed_chars += 2
+                    # Check if these characters are correct
+                    missed = mismatched_targets('  ', target_text, current_pos)
+                    wrong_typed_chars += len(missed)
+                    correct_chars += min(2, len(target_text) - current_pos) - len(missed)
+                    missed_chars.update(missed)
+                    current_pos += 2
+                elif char == '\n' or char == '\r':  # Enter key - autoindent
+                    # Newline plus indentation at the end of a target line, elsewhere just the newline
+                    indent_to_add = enter_actions.get(current_pos, '\n')
+                    typed_buf += indent_to_add.encode('latin-1')
                     all_typed_chars += len(indent_to_add)
                     # Check if these characters are correct
-                    for i in range(current_pos, min(current_pos + len(indent_to_add), len(target_text))):
-                        if i >= len(target_text) or typed_text[i] != target_text[i]:
-                            wrong_typed_chars += 1
-                            if i < len(target_text):
-                                missed_chars[target_text[i]] += 1
+                    missed = mismatched_targets(indent_to_add, target_text, current_pos)
+                    wrong_typed_chars += len(missed)
+                    correct_chars += min(len(indent_to_add), len(target_text) - current_pos) - len(missed)
+                    missed_chars.update(missed)
                     current_pos += len(indent_to_add)
-            else:
-                typed_text += char
-                all_typed_chars += 1
-                # Check if this character is correct
-                if current_pos >= len(target_text) or char != target_text[current_pos]:
-                    wrong_typed_chars += 1
-                    if current_pos < len(target_text):
+                else:
+                    if char_byte > 0xFF and isinstance(typed_buf, bytearray):
+                        typed_buf = list(typed_buf)  # Same fallback as encode_cells
+                    typed_buf.append(char_byte)
+                    all_typed_chars += 1
+                    # Check if this character is correct, the loop condition keeps current_pos in range
+                    if char_byte == target_bytes[current_pos]:
+                        correct_chars += 1
+                    else:
+                        wrong_typed_chars += 1
                         missed_chars[target_text[current_pos]] += 1
-                current_pos += 1
+                    current_pos += 1
+                render_state.min_pos = min(render_state.min_pos, current_pos)
+                dirty = True
+        finally:
+            # Leave the cursor below the text for whatever is printed next
+            write_frame([f"\033[{get_terminal_size().lines};1H\r\n".encode()])
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
         # Calculate elapsed time
         elapsed_time = time.time() - start_time
 
         # Calculate and display metrics
-        metrics = calculate_metrics(target_text, typed_text, elapsed_time, all_typed_chars, wrong_typed_chars)
+        typed_text = ''.join(map(chr, typed_buf))
+        metrics = calculate_metrics(target_text, typed_text, elapsed_time, all_typed_chars, wrong_typed_chars, correct_chars)
         display_results(metrics, missed_chars)
 
         # Save to data file